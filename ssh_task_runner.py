@@ -1,5 +1,32 @@
+from __future__ import annotations
+
+import atexit
+import copy
+import functools
+import hashlib
+import itertools
 import logging
-import paramiko
+import os
+import pickle
+import select
+import shutil
+import socket
+import stat
+import subprocess
+import tempfile
+import threading
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional
+
+# paramiko, asyncssh, asyncio and the TOML parser are imported where they are
+# used, so a process that never connects or parses a config does not pay for
+# them.
+if TYPE_CHECKING:
+    import asyncssh
+    import paramiko
 
 
 # --- Logging setup ---
@@ -9,144 +36,1122 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+RECV_CHUNK_SIZE = 65536
+POLL_INTERVAL = 1.0
+
+# Parsed configs by absolute path, with the (mtime, size) they were read at.
+_CONFIG_CACHE: dict = {}
+
+
+# --- Config parsing ---
+def _config_cache_dir() -> Optional[Path]:
+    """
+    Returns the private directory for parsed config pickles, or None.
+
+    None is returned when the directory exists but is not a real directory
+    owned by and accessible only to the current user, since loading a pickle
+    someone else could write would run their code.
+    """
+
+    uid = os.getuid() if hasattr(os, "getuid") else None
+    owner = "user" if uid is None else uid
+    path = Path(tempfile.gettempdir()) / f"ssh_task_runner-config-{owner}"
+
+    try:
+        path.mkdir(mode=0o700, exist_ok=True)
+        st = path.lstat()
+    except OSError:
+        return None
+
+    if not stat.S_ISDIR(st.st_mode):
+        return None
+    if uid is not None and (st.st_uid != uid or st.st_mode & 0o077):
+        return None
+    return path
+
+
+def _parse_config(data: bytes, path: str) -> dict:
+    """
+    Parses TOML config bytes read from `path`.
+
+    The result is pickled to disk together with a hash of the bytes, so later
+    processes reading an unchanged file unpickle it instead of parsing. There
+    is one pickle per config path, replaced whenever the file changes.
+    """
+
+    cache_dir = _config_cache_dir()
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    if cache_dir is not None:
+        name = hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+        cache_path = cache_dir / f"{name}.pkl"
+        try:
+            cached_digest, config = pickle.loads(cache_path.read_bytes())
+            if cached_digest == digest:
+                return config
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Ignoring unreadable config cache %s: %s", cache_path, e)
+
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        import tomli as tomllib
+
+    config = tomllib.loads(data.decode())
+
+    if cache_dir is not None:
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+                tmp_path = f.name
+                f.write(pickle.dumps((digest, config)))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning("Failed to write config cache: %s", e)
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+    return config
+
 
 # --- Command class ---
 class Command:
     """
     Represents a shell command to be executed over SSH.
+
+    Output streams that are not captured are discarded on the remote host,
+    so they never cross the network.
     """
 
+    __slots__ = (
+        "command",
+        "description",
+        "directory",
+        "needs_pty",
+        "capture_stdout",
+        "capture_stderr",
+        "_built",
+    )
+
     def __init__(
-        self, command: str, description: str = "", directory: str = None
+        self,
+        command: str,
+        description: str = "",
+        directory: str = None,
+        needs_pty: bool = False,
+        capture_stdout: bool = True,
+        capture_stderr: bool = True,
     ) -> None:
         self.command = command
         self.description = description
         self.directory = directory
+        self.needs_pty = needs_pty
+        self.capture_stdout = capture_stdout
+        self.capture_stderr = capture_stderr
+        self._built = None
 
     def build(self) -> str:
-        if self.directory:
-            return f"cd {self.directory} && {self.command}"
-        return self.command
+        """Returns the full shell command, computed on first call and cached."""
 
+        if self._built is None:
+            if self.directory:
+                built = f"cd {self.directory} && {self.command}"
+            else:
+                built = self.command
 
-# --- SSHTaskRunner class ---
-class SSHTaskRunner:
+            redirects = ""
+            if not self.capture_stdout:
+                redirects += " >/dev/null"
+            if not self.capture_stderr:
+                redirects += " 2>/dev/null"
+            if redirects:
+                built = f"{{ {built}\n}}{redirects}"
+
+            self._built = built
+        return self._built
+
+
+# --- Result class ---
+@dataclass(slots=True)
+class Result:
+    """
+    Outcome of a single executed command.
     """
-    Executes a sequence of commands over SSH, including parallel execution.
 
-    Loads configuration from a .toml file and manages SSH connections.
+    description: str
+    command: str
+    stdout: str = ""
+    stderr: str = ""
+    exit_status: int = 0
+
+
+# --- Host key verification ---
+@functools.lru_cache(maxsize=None)
+def _known_hosts() -> paramiko.HostKeys:
+    """Loads the user's known_hosts file once per process."""
+
+    import paramiko
+
+    path = os.path.expanduser("~/.ssh/known_hosts")
+    if os.path.exists(path):
+        return paramiko.HostKeys(path)
+    return paramiko.HostKeys()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_private_key(path: str, passphrase: str = None) -> paramiko.PKey:
+    """Loads a private key file once per process."""
+
+    import paramiko
+
+    return paramiko.PKey.from_path(os.path.expanduser(path), password=passphrase)
+
+
+# --- SSHPool class ---
+_POOL: dict = {}
+_BORROWED: dict = {}
+_POOL_LOCK = threading.Lock()
+
+
+class SSHPool:
     """
+    Process-wide pool of idle SSH connections keyed by the settings they were
+    opened with.
 
-    from typing import List
+    Borrowing a pooled connection skips the TCP handshake, key exchange and
+    authentication that a fresh connection pays. The key must cover every
+    setting that affects how a connection is verified and authenticated, so
+    a runner never borrows a connection its own settings would have refused.
+    """
 
-    def __init__(self, config_path: str):
-        self.config = self._load_config(config_path)
-        self.main_ssh = self._create_connection()
-        logger.info("Main SSH connection established.")
+    KEEPALIVE_INTERVAL = 30
+
+    @classmethod
+    def get(
+        cls, key: tuple, connect: Callable[[], paramiko.SSHClient]
+    ) -> paramiko.SSHClient:
+        """Borrows an idle live connection for `key`, or opens one with `connect`."""
+
+        client = None
+
+        with _POOL_LOCK:
+            idle = _POOL.get(key)
+            while idle:
+                candidate = idle.pop()
+                if cls._is_active(candidate):
+                    client = candidate
+                    break
+                candidate.close()
+
+        if client is None:
+            client = connect()
+        client.get_transport().set_keepalive(cls.KEEPALIVE_INTERVAL)
+
+        with _POOL_LOCK:
+            _BORROWED[client] = key
+        return client
+
+    @classmethod
+    def put(cls, client: paramiko.SSHClient) -> None:
+        """
+        Returns a borrowed connection to the pool. Dead connections are closed.
+
+        Connections the pool did not lend out, or already got back, are ignored.
+        """
+
+        with _POOL_LOCK:
+            key = _BORROWED.pop(client, None)
+            if key is None:
+                return
+            if cls._is_active(client):
+                _POOL.setdefault(key, deque()).append(client)
+                return
+        client.close()
+
+    @classmethod
+    def clear(cls) -> None:
+        """Closes all idle connections."""
+
+        with _POOL_LOCK:
+            idle = [client for clients in _POOL.values() for client in clients]
+            _POOL.clear()
+        for client in idle:
+            client.close()
+
+    @staticmethod
+    def _is_active(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+
+# Idle pooled connections are closed cleanly at exit, not at interpreter teardown.
+atexit.register(SSHPool.clear)
+
+
+# --- Runner base class ---
+class _RunnerBase:
+    """
+    Configuration loading and result logging shared by the runners.
+    """
 
     def _load_config(self, path: str) -> dict:
-        """Loads configuration from a TOML file."""
+        """
+        Loads configuration from a TOML file.
 
-        import toml
+        Parsed configs are cached per process and reparsed only when the
+        file's mtime or size changes; parsing itself goes through the on-disk
+        cache of _parse_config(). Callers get a deep copy they may mutate.
+        """
 
         try:
-            return toml.load(path)
+            st = os.stat(path)
+            abspath = os.path.abspath(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+
+            cached = _CONFIG_CACHE.get(abspath)
+            if cached is None or cached[0] != stamp:
+                with open(path, "rb") as f:
+                    cached = _CONFIG_CACHE[abspath] = (
+                        stamp,
+                        _parse_config(f.read(), abspath),
+                    )
+
+            return copy.deepcopy(cached[1])
         except Exception as e:
-            logger.error(f"Failed to load config: {e}")
+            logger.error("Failed to load config: %s", e)
+            raise
+
+    def _log_result(self, result: Result) -> None:
+        """Logs the result of command execution."""
+
+        logger.info("Command: %s", result.description)
+        logger.info("Exit status: %s", result.exit_status)
+
+        if result.stdout:
+            logger.info("STDOUT:\n%s", result.stdout)
+
+        if result.stderr:
+            if result.exit_status == 0:
+                logger.info("STDERR (informational):\n%s", result.stderr)
+            else:
+                logger.error("STDERR:\n%s", result.stderr)
+
+
+# --- SSHTaskRunner class ---
+class SSHTaskRunner(_RunnerBase):
+    """
+    Executes a sequence of commands over SSH, including parallel execution.
+
+    Loads configuration from a .toml file and manages SSH connections.
+
+    The "paramiko" backend talks SSH in-process over a pooled connection. The
+    "controlmaster" backend runs the OpenSSH client and multiplexes every
+    command over one master connection through a local control socket; it
+    authenticates with `key_filename` or the ssh-agent, not with a password.
+    """
+
+    CONTROL_PERSIST = 60
+    # Seconds close() gives the controlmaster shell to exit before killing it.
+    SHELL_EXIT_TIMEOUT = 2
+
+    def __init__(self, config_path: str, backend: str = "paramiko"):
+        if backend not in ("paramiko", "controlmaster"):
+            raise ValueError(f"Unknown backend: {backend}")
+
+        self.config = self._load_config(config_path)
+        self.backend = backend
+        self.main_ssh = None
+        self._control_dir = None
+        self._outbuf = bytearray()
+        self._errbuf = bytearray()
+        # The persistent shell is opened by the first shell mode step.
+        self.chan = None
+
+        try:
+            if backend == "controlmaster":
+                self._control_dir = tempfile.mkdtemp(prefix="ssh_task_runner-")
+                self._start_master()
+                logger.info("SSH control master started.")
+            else:
+                self.main_ssh = self._create_connection()
+                self._transport = self.main_ssh.get_transport()
+                logger.info("Main SSH connection established.")
+        except BaseException:
+            self.close()
             raise
 
     def _create_connection(self) -> paramiko.SSHClient:
-        """Creates and returns a new SSH connection."""
+        """Borrows an SSH connection from the pool, connecting if none is idle."""
 
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(
-            hostname=self.config["ssh"]["host"],
-            username=self.config["ssh"]["user"],
-            password=self.config["ssh"]["password"],
-            port=self.config["ssh"].get("port", 22),
+        return SSHPool.get(
+            key=(
+                self.config["ssh"]["host"],
+                self.config["ssh"]["user"],
+                self.config["ssh"].get("port", 22),
+                self.config["ssh"].get("password"),
+                self.config["ssh"].get("key_filename"),
+                self.config["ssh"].get("key_passphrase"),
+                self.config["ssh"].get("auto_add_host_key", False),
+                self.config["ssh"].get("compress", True),
+            ),
+            connect=self._connect,
         )
+
+    def _connect(self) -> paramiko.SSHClient:
+        """
+        Creates and returns a new SSH connection.
+
+        The server's host key must be listed in ~/.ssh/known_hosts unless
+        `auto_add_host_key = true` is set in the [ssh] config.
+
+        When `key_filename` is set, public key authentication is used instead
+        of the password. An Ed25519 key authenticates in a single signature
+        round-trip; SHA-1 RSA signatures are never offered.
+
+        zlib compression is negotiated unless `compress = false` is set in the
+        [ssh] config: command output such as listings and logs compresses well,
+        and spending a little CPU is cheaper than moving the bytes over a WAN.
+        """
+
+        host = self.config["ssh"]["host"]
+        port = self.config["ssh"].get("port", 22)
+
+        if self.config["ssh"].get("key_filename"):
+            auth = {
+                "pkey": _load_private_key(
+                    self.config["ssh"]["key_filename"],
+                    self.config["ssh"].get("key_passphrase"),
+                ),
+                "look_for_keys": False,
+                "allow_agent": False,
+                "disabled_algorithms": {"pubkeys": ["ssh-rsa"]},
+            }
+        else:
+            auth = {"password": self.config["ssh"]["password"]}
+
+        sock = self._open_socket(host, port)
+
+        import paramiko
+
+        ssh = paramiko.SSHClient()
+        if self.config["ssh"].get("auto_add_host_key", False):
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        else:
+            # This host's entries from the cached known_hosts file. connect()
+            # checks the server against them and offers their key type first.
+            name = host if port == 22 else f"[{host}]:{port}"
+            known = _known_hosts().lookup(name)
+            if known is not None:
+                for key_type, key in known.items():
+                    ssh.get_host_keys().add(name, key_type, key)
+            ssh.set_missing_host_key_policy(paramiko.RejectPolicy())
+        try:
+            ssh.connect(
+                hostname=host,
+                username=self.config["ssh"]["user"],
+                port=port,
+                sock=sock,
+                compress=self.config["ssh"].get("compress", True),
+                **auth,
+            )
+        except Exception:
+            # Closes the transport thread along with the socket.
+            ssh.close()
+            raise
         return ssh
 
-    def _run_command(self, ssh: paramiko.SSHClient, command: Command) -> dict:
-        """Executes a single command on a given SSH connection."""
+    @staticmethod
+    def _open_socket(host: str, port: int) -> socket.socket:
+        """
+        Opens a TCP socket with Nagle's algorithm disabled.
+
+        Set before the handshake so key exchange and short command output
+        are not held back waiting for ACKs.
+        """
+
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if hasattr(socket, "TCP_QUICKACK"):  # Linux only
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        return sock
+
+    def _ssh_args(self) -> list:
+        """Returns the OpenSSH client arguments for the control socket."""
+
+        return [
+            "ssh",
+            "-S",
+            os.path.join(self._control_dir, "control.sock"),
+            "-p",
+            str(self.config["ssh"].get("port", 22)),
+            "-l",
+            self.config["ssh"]["user"],
+            "-o",
+            "BatchMode=yes",
+        ]
+
+    def _start_master(self) -> None:
+        """
+        Starts the OpenSSH control master in the background.
+
+        The master exits on its own after CONTROL_PERSIST idle seconds if
+        close() is never called.
+        """
+
+        args = self._ssh_args() + [
+            "-M",
+            "-N",
+            "-f",
+            "-o",
+            f"ControlPersist={self.CONTROL_PERSIST}",
+        ]
+        if self.config["ssh"].get("auto_add_host_key", False):
+            args += ["-o", "StrictHostKeyChecking=accept-new"]
+        else:
+            args += ["-o", "StrictHostKeyChecking=yes"]
+        if self.config["ssh"].get("compress", True):
+            args.append("-C")
+        if self.config["ssh"].get("key_filename"):
+            args += ["-i", os.path.expanduser(self.config["ssh"]["key_filename"])]
+
+        # The backgrounded master keeps the inherited stderr open, so it goes
+        # to a file rather than a pipe that would never reach EOF.
+        log_path = os.path.join(self._control_dir, "master.log")
+        with open(log_path, "wb") as log:
+            completed = subprocess.run(
+                args + [self.config["ssh"]["host"]],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=log,
+            )
+
+        if completed.returncode != 0:
+            with open(log_path, errors="replace") as log:
+                message = log.read().strip()
+            raise ConnectionError(f"Failed to start SSH control master: {message}")
+
+    def _open_shell(self):
+        """
+        Opens a persistent shell on the main connection.
+
+        Returns a paramiko channel, or an ssh client process for the
+        controlmaster backend. No pty is requested, so stderr stays separate
+        and input is not echoed.
+        """
+
+        if self.backend == "controlmaster":
+            return subprocess.Popen(
+                self._ssh_args() + ["-T", self.config["ssh"]["host"]],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+
+        chan = self._transport.open_session()
+        chan.invoke_shell()
+        return chan
+
+    def _shell(self):
+        """
+        Returns the persistent shell, opening it on first use.
+
+        Whatever the login shell's startup files print is read past before
+        the first step, so it does not end up in that step's output.
+        """
+
+        if self.chan is None:
+            self.chan = self._open_shell()
+            marker = f"__RC_{uuid.uuid4().hex}__"
+            self._send_shell(self._wrap(":", marker))
+            self._read_shell(marker)
+        return self.chan
+
+    def _send_shell(self, script: str) -> None:
+        """Writes a script to the persistent shell's stdin."""
+
+        if self.backend == "controlmaster":
+            self.chan.stdin.write(script.encode())
+            self.chan.stdin.flush()
+        else:
+            self.chan.sendall(script.encode())
+
+    def _recv_shell(self) -> tuple:
+        """
+        Waits for output from the persistent shell. Returns (stdout, stderr) chunks.
+
+        Either chunk may be empty. Raises EOFError once the shell has closed,
+        and TimeoutError when nothing arrives within the [ssh] `timeout`.
+        """
+
+        timeout = self.config["ssh"].get("timeout")
+
+        if self.backend == "controlmaster":
+            streams = [self.chan.stdout, self.chan.stderr]
+            ready, _, _ = select.select(streams, [], [], timeout)
+            if not ready:
+                raise TimeoutError("Timed out waiting for shell output.")
+
+            chunks = []
+            for stream in streams:
+                chunk = b""
+                if stream in ready:
+                    chunk = os.read(stream.fileno(), RECV_CHUNK_SIZE)
+                    if not chunk:
+                        raise EOFError("Shell closed before the command completed.")
+                chunks.append(chunk)
+            return tuple(chunks)
+
+        ready, _, _ = select.select([self.chan], [], [], timeout)
+        if not ready:
+            raise TimeoutError("Timed out waiting for shell output.")
+
+        out = self.chan.recv(RECV_CHUNK_SIZE) if self.chan.recv_ready() else b""
+        err = b""
+        if self.chan.recv_stderr_ready():
+            err = self.chan.recv_stderr(RECV_CHUNK_SIZE)
+        if not out and not err and (self.chan.eof_received or self.chan.closed):
+            raise EOFError("Shell closed before the command completed.")
+        return out, err
+
+    def _read_shell(self, marker: str) -> tuple:
+        """
+        Reads the persistent shell's output up to the marker on both streams.
+
+        The two streams are read as data arrives on either, so a step that
+        fills one stream's transport buffer cannot stall while the other is
+        being waited on. Returns (stdout, stderr, exit status).
+        """
+
+        out_end = f"\n{marker}".encode()
+        err_end = f"\n{marker}\n".encode()
+        out = self._outbuf
+        err = self._errbuf
+        del out[:]
+        del err[:]
+        out_at = err_at = status_end = -1
+
+        while err_at < 0 or status_end < 0:
+            out_chunk, err_chunk = self._recv_shell()
+
+            if out_chunk:
+                # Start a little early in case the marker spans two chunks.
+                start = max(0, len(out) - len(out_end) + 1)
+                out.extend(out_chunk)
+                if out_at < 0:
+                    out_at = out.find(out_end, start)
+                if out_at >= 0 and status_end < 0:
+                    status_end = out.find(b"\n", out_at + len(out_end))
+
+            if err_chunk and err_at < 0:
+                start = max(0, len(err) - len(err_end) + 1)
+                err.extend(err_chunk)
+                err_at = err.find(err_end, start)
+
+        return (
+            out[:out_at].decode("utf-8", "replace"),
+            err[:err_at].decode("utf-8", "replace"),
+            int(out[out_at + len(out_end) : status_end]),
+        )
+
+    def _run_command(self, command: Command) -> Result:
+        """Executes a single command on its own channel of the main connection."""
+
+        return self._run_command_streaming(command)
+
+    def _run_command_streaming(
+        self,
+        command: Command,
+        on_stdout: Callable[[bytes], None] = None,
+        on_stderr: Callable[[bytes], None] = None,
+    ) -> Result:
+        """
+        Executes a single command, passing output chunks to the callbacks.
+
+        Chunks are delivered as they arrive, while the command is still
+        running. A stream without a callback is collected into the result.
+        """
 
         full_cmd = command.build()
         description = command.description or command.command
-        result = {
-            "description": description,
-            "command": full_cmd,
-            "stdout": None,
-            "stderr": None,
-            "exit_status": None,
-        }
+        out = self._outbuf
+        err = self._errbuf
+        del out[:]
+        del err[:]
 
         try:
-            stdin, stdout, stderr = ssh.exec_command(full_cmd)
+            exit_status = self._exec_streaming(
+                full_cmd,
+                on_stdout or out.extend,
+                on_stderr or err.extend,
+                pty=command.needs_pty,
+            )
+        except Exception as e:
+            return Result(
+                description=description,
+                command=full_cmd,
+                stderr=str(e),
+                exit_status=-1,
+            )
+
+        return Result(
+            description=description,
+            command=full_cmd,
+            stdout=out.decode("utf-8", "replace").strip(),
+            stderr=err.decode("utf-8", "replace").strip(),
+            exit_status=exit_status,
+        )
 
-            out = stdout.read().decode().strip()
-            err = stderr.read().decode().strip()
-            exit_status = stdout.channel.recv_exit_status()
+    def _exec(self, full_cmd: str, pty: bool = False) -> tuple:
+        """
+        Runs a command and collects its output. Returns (stdout, stderr, exit status).
 
-            result["stdout"] = out
-            result["stderr"] = err
-            result["exit_status"] = exit_status
+        The output buffers are reused across calls, so decode them before the
+        next call.
+        """
 
-            return result
+        out = self._outbuf
+        err = self._errbuf
+        del out[:]
+        del err[:]
+        exit_status = self._exec_streaming(full_cmd, out.extend, err.extend, pty)
+        return out, err, exit_status
+
+    def _exec_streaming(
+        self,
+        full_cmd: str,
+        on_stdout: Callable[[bytes], None],
+        on_stderr: Callable[[bytes], None],
+        pty: bool = False,
+    ) -> int:
+        """
+        Runs a command on a new channel, passing output chunks to the callbacks.
+
+        Both streams are drained as data arrives, so a large stderr cannot
+        stall the command while stdout is still being read. A pty is
+        allocated only when `pty` is set; the remote side then merges stderr
+        into stdout. Returns the exit status.
+        """
+
+        if self.backend == "controlmaster":
+            args = self._ssh_args()
+            if pty:
+                # -q drops the "Shared connection closed" notice -tt prints.
+                args += ["-tt", "-q"]
+
+            with subprocess.Popen(
+                args + [self.config["ssh"]["host"], full_cmd],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            ) as proc:
+                callbacks = {proc.stdout: on_stdout, proc.stderr: on_stderr}
+                while callbacks:
+                    ready, _, _ = select.select(list(callbacks), [], [])
+                    for stream in ready:
+                        chunk = os.read(stream.fileno(), RECV_CHUNK_SIZE)
+                        if chunk:
+                            callbacks[stream](chunk)
+                        else:
+                            del callbacks[stream]
+            return proc.returncode
+
+        chan = self._transport.open_session()
+        try:
+            chan.set_combine_stderr(False)
+            if pty:
+                chan.get_pty(term="dumb")
+            chan.exec_command(full_cmd)
+
+            # The exit status can arrive before the last of the output, so
+            # the streams are drained until EOF rather than until it is set.
+            while (
+                not (chan.eof_received or chan.closed)
+                or chan.recv_ready()
+                or chan.recv_stderr_ready()
+            ):
+                select.select([chan], [], [], POLL_INTERVAL)
+                if chan.recv_ready():
+                    on_stdout(chan.recv(RECV_CHUNK_SIZE))
+                if chan.recv_stderr_ready():
+                    on_stderr(chan.recv_stderr(RECV_CHUNK_SIZE))
+
+            return chan.recv_exit_status()
+
+        finally:
+            chan.close()
+
+    @staticmethod
+    def _wrap(full_cmd: str, marker: str) -> str:
+        """
+        Wraps a command for running inside a shell script.
+
+        The command runs in a subshell so directory changes and `exit` do not
+        leak into later steps. Afterwards the marker is printed on its own
+        line to stdout, followed by the exit status, and to stderr. The exit
+        status is also left in $rc.
+        """
+
+        return (
+            f"( {full_cmd}\n) < /dev/null; rc=$?; "
+            f"printf '\\n{marker}%d\\n' $rc; "
+            f"printf '\\n{marker}\\n' >&2\n"
+        )
+
+    def _run_shell_command(self, command: Command) -> Result:
+        """
+        Executes a single command on the persistent shell channel.
+
+        Completion is detected by a unique marker written to both streams,
+        the stdout one carrying the exit status.
+        """
+
+        full_cmd = command.build()
+        description = command.description or command.command
+        marker = f"__RC_{uuid.uuid4().hex}__"
+
+        try:
+            self._shell()
+            self._send_shell(self._wrap(full_cmd, marker))
+            out, err, exit_status = self._read_shell(marker)
+
+            return Result(
+                description=description,
+                command=full_cmd,
+                stdout=out.strip(),
+                stderr=err.strip(),
+                exit_status=exit_status,
+            )
 
         except Exception as e:
-            result["stdout"] = ""
-            result["stderr"] = str(e)
-            result["exit_status"] = -1
+            return Result(
+                description=description,
+                command=full_cmd,
+                stderr=str(e),
+                exit_status=-1,
+            )
 
-            return result
+    def _run_batch(self, sequence: List[Command]) -> List[Result]:
+        """
+        Executes a sequence as a single remote script on one channel.
 
-    def _log_result(self, result: dict) -> None:
-        """Logs the result of command execution."""
+        Each step is followed by a numbered marker used to split the output
+        back into per-step results. The script exits at the first failing
+        step, so results are returned only for the steps that ran.
+        """
 
-        logger.info(f"Command: {result["description"]}")
-        logger.info(f"Exit status: {result['exit_status']}")
+        token = uuid.uuid4().hex
+        markers = [f"__RC_{token}_{i}__" for i in range(len(sequence))]
+        script = "".join(
+            self._wrap(step.build(), marker) + "[ $rc -eq 0 ] || exit $rc\n"
+            for step, marker in zip(sequence, markers)
+        )
 
-        if result["stdout"].strip():
-            logger.info("STDOUT:\n" + result["stdout"].strip())
+        try:
+            out, err, exit_status = self._exec(script)
+            out = out.decode("utf-8", "replace")
+            err = err.decode("utf-8", "replace")
+        except Exception as e:
+            out, err, exit_status = "", str(e), -1
 
-        if result["stderr"].strip():
-            if result["exit_status"] == 0:
-                logger.info("STDERR (informational):\n" + result["stderr"].strip())
+        results = []
+        for step, marker in zip(sequence, markers):
+            step_out, found, out = out.partition(marker)
+            step_err, _, err = err.partition(marker)
+            if found:
+                step_status, _, out = out.partition("\n")
+                step_status = int(step_status)
+                err = err.partition("\n")[2]
             else:
-                logger.error("STDERR:\n" + result["stderr"].strip())
+                step_status = exit_status if exit_status != 0 else -1
 
-    def execute(self, sequence: List[Command]) -> None:
+            results.append(
+                Result(
+                    description=step.description or step.command,
+                    command=step.build(),
+                    stdout=step_out.strip(),
+                    stderr=step_err.strip(),
+                    exit_status=step_status,
+                )
+            )
+
+            if step_status != 0:
+                break
+
+        return results
+
+    def close(self) -> None:
         """
-        Executes a sequence of commands.
+        Closes the shell and releases the main connection.
 
-        Aborts on first failure.
+        A paramiko connection goes back to the pool; a control master is
+        stopped and its socket directory removed. Calling it again does
+        nothing.
         """
 
-        try:
-            for step in sequence:
-                if isinstance(step, Command):
-                    result = self._run_command(self.main_ssh, step)
-                    self._log_result(result)
+        if self.chan is not None:
+            if self.backend == "controlmaster":
+                self.chan.stdin.close()
+                try:
+                    self.chan.wait(timeout=self.SHELL_EXIT_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    # A step is still running, e.g. after a shell mode timeout.
+                    self.chan.kill()
+                    self.chan.wait()
+                self.chan.stdout.close()
+                self.chan.stderr.close()
+            else:
+                self.chan.close()
+            self.chan = None
 
-                    if result["exit_status"] != 0:
-                        logger.error("Execution aborted due to command failure.")
+        if self.backend == "controlmaster":
+            if self._control_dir is not None:
+                if os.path.exists(os.path.join(self._control_dir, "control.sock")):
+                    subprocess.run(
+                        self._ssh_args() + ["-O", "exit", self.config["ssh"]["host"]],
+                        stdin=subprocess.DEVNULL,
+                        capture_output=True,
+                    )
+                    logger.info("SSH control master stopped.")
+                shutil.rmtree(self._control_dir, ignore_errors=True)
+                self._control_dir = None
+        elif self.main_ssh is not None:
+            SSHPool.put(self.main_ssh)
+            self.main_ssh = None
+            self._transport = None
+            logger.info("Main SSH connection returned to pool.")
+
+    def _run_sequence(
+        self,
+        sequence: List[Command],
+        mode: str,
+        on_stdout: Callable[[bytes], None] = None,
+        on_stderr: Callable[[bytes], None] = None,
+    ) -> Iterator[Result]:
+        """
+        Yields the result of each executed step.
+
+        Steps that need a pty always run on their own exec channel, since the
+        shared shell and batch channels have none.
+        """
+
+        if mode == "batched":
+            if not all(isinstance(step, Command) for step in sequence):
+                raise ValueError("Invalid step in sequence.")
+
+            for needs_pty, group in itertools.groupby(
+                sequence, key=lambda step: step.needs_pty
+            ):
+                if needs_pty:
+                    results = map(self._run_command, group)
+                else:
+                    results = self._run_batch(list(group))
+
+                for result in results:
+                    yield result
+                    if result.exit_status != 0:
                         return
+            return
+
+        for step in sequence:
+            if isinstance(step, Command):
+                if mode == "shell" and not step.needs_pty:
+                    yield self._run_shell_command(step)
                 else:
-                    raise ValueError("Invalid step in sequence.")
+                    yield self._run_command_streaming(step, on_stdout, on_stderr)
+            else:
+                raise ValueError("Invalid step in sequence.")
+
+    def execute(
+        self,
+        sequence: List[Command],
+        mode: str = "shell",
+        on_stdout: Callable[[bytes], None] = None,
+        on_stderr: Callable[[bytes], None] = None,
+    ) -> None:
+        """
+        Executes a sequence of commands.
+
+        In "shell" mode all steps are written to one persistent shell channel;
+        in "exec" mode every step opens its own channel; in "batched" mode the
+        whole sequence is sent as one script. Aborts on first failure.
+
+        In "exec" mode, `on_stdout` and `on_stderr` receive output chunks as
+        they arrive instead of the output being collected and logged.
+        """
+
+        if mode not in ("shell", "exec", "batched"):
+            raise ValueError(f"Unknown execution mode: {mode}")
+        if (on_stdout or on_stderr) and mode != "exec":
+            raise ValueError("Streaming output requires the exec mode.")
+
+        try:
+            for result in self._run_sequence(sequence, mode, on_stdout, on_stderr):
+                self._log_result(result)
+
+                if result.exit_status != 0:
+                    logger.error("Execution aborted due to command failure.")
+                    return
 
             logger.info("All commands completed successfully.")
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            logger.error("Unexpected error: %s", e)
             raise
         finally:
-            self.main_ssh.close()
-            logger.info("Main SSH connection closed.")
+            self.close()
 
 
-def main() -> None:
-    from pathlib import Path
+# --- AsyncSSHTaskRunner class ---
+class AsyncSSHTaskRunner(_RunnerBase):
+    """
+    Executes independent commands concurrently over a single asyncssh connection.
+
+    Requires the optional asyncssh package.
+    """
+
+    # sshd's default MaxSessions caps the channels open on one connection.
+    MAX_CONCURRENT = 10
+
+    def __init__(self, config_path: str):
+        try:
+            import asyncssh  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "AsyncSSHTaskRunner requires the asyncssh package."
+            ) from None
+        self.config = self._load_config(config_path)
+
+    async def _connect(self) -> asyncssh.SSHClientConnection:
+        """Creates and returns a new asyncssh connection."""
+
+        import asyncssh
+
+        if self.config["ssh"].get("compress", True):
+            compression_algs = ("zlib@openssh.com", "zlib", "none")
+        else:
+            compression_algs = ("none",)
+
+        # None disables host key checks; () means the default known_hosts file.
+        if self.config["ssh"].get("auto_add_host_key", False):
+            known_hosts = None
+        else:
+            known_hosts = ()
+
+        if self.config["ssh"].get("key_filename"):
+            auth = {
+                "client_keys": [os.path.expanduser(self.config["ssh"]["key_filename"])],
+                "passphrase": self.config["ssh"].get("key_passphrase"),
+            }
+        else:
+            auth = {"password": self.config["ssh"]["password"]}
+
+        return await asyncssh.connect(
+            self.config["ssh"]["host"],
+            port=self.config["ssh"].get("port", 22),
+            username=self.config["ssh"]["user"],
+            known_hosts=known_hosts,
+            compression_algs=compression_algs,
+            **auth,
+        )
+
+    async def _run_command(
+        self, conn: asyncssh.SSHClientConnection, command: Command
+    ) -> Result:
+        """
+        Executes a single command on a given asyncssh connection.
+
+        Invalid UTF-8 is replaced, as on the paramiko path; strict decoding
+        makes asyncssh drop the shared connection and every command on it.
+        """
+
+        full_cmd = command.build()
+        description = command.description or command.command
 
+        try:
+            completed = await conn.run(
+                full_cmd,
+                check=False,
+                term_type="dumb" if command.needs_pty else None,
+                errors="replace",
+            )
+
+            stderr = completed.stderr.strip()
+            exit_status = completed.returncode
+            if exit_status is None:
+                stderr = f"{stderr}\nChannel closed without an exit status.".strip()
+                exit_status = -1
+
+            return Result(
+                description=description,
+                command=full_cmd,
+                stdout=completed.stdout.strip(),
+                stderr=stderr,
+                exit_status=exit_status,
+            )
+
+        except Exception as e:
+            return Result(
+                description=description,
+                command=full_cmd,
+                stderr=str(e),
+                exit_status=-1,
+            )
+
+    async def execute_parallel(
+        self, sequence: List[Command], max_concurrent: int = MAX_CONCURRENT
+    ) -> List[Result]:
+        """
+        Executes independent commands concurrently.
+
+        At most `max_concurrent` commands run at once. Every command runs to
+        completion regardless of failures; results keep the sequence order.
+        """
+
+        import asyncio
+
+        for step in sequence:
+            if not isinstance(step, Command):
+                raise ValueError("Invalid step in sequence.")
+
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async with await self._connect() as conn:
+            logger.info("Async SSH connection established.")
+
+            async def guarded(command: Command) -> Result:
+                async with semaphore:
+                    return await self._run_command(conn, command)
+
+            results = await asyncio.gather(*(guarded(step) for step in sequence))
+
+        logger.info("Async SSH connection closed.")
+
+        for result in results:
+            self._log_result(result)
+
+        failed = sum(result.exit_status != 0 for result in results)
+        if failed:
+            logger.error("%d of %d commands failed.", failed, len(results))
+        else:
+            logger.info("All commands completed successfully.")
+
+        return results
+
+    def execute(
+        self, sequence: List[Command], max_concurrent: int = MAX_CONCURRENT
+    ) -> List[Result]:
+        """Synchronous wrapper around execute_parallel()."""
+
+        import asyncio
+
+        return asyncio.run(self.execute_parallel(sequence, max_concurrent))
+
+
+def main() -> None:
     CONFIG_PATH = Path(__file__).parent / "config.toml"
 
     repo_dir = "/home"
@@ -0,0 +1,576 @@
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import ssh_task_runner
+from ssh_task_runner import Command, SSHTaskRunner, _RunnerBase
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("bash") is None, reason="requires a local bash"
+)
+
+# Stands in for the OpenSSH client: whatever follows the host runs in a local
+# bash, and without a command it starts a shell that prints a banner first,
+# like a login shell's startup files might.
+FAKE_SSH = """#!/bin/sh
+while [ "$#" -gt 0 ] && [ "$1" != fake-host ]; do
+    [ "$1" = -O ] && exit 0
+    shift
+done
+shift
+if [ "$#" -eq 0 ]; then
+    echo banner
+    echo banner >&2
+    exec bash
+fi
+exec bash -c "$*"
+"""
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    """A controlmaster runner whose ssh client is FAKE_SSH."""
+
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "ssh").write_text(FAKE_SSH)
+    (bin_dir / "ssh").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    config = {"ssh": {"host": "fake-host", "user": "user", "timeout": 10}}
+    monkeypatch.setattr(SSHTaskRunner, "_load_config", lambda self, path: config)
+    monkeypatch.setattr(SSHTaskRunner, "_start_master", lambda self: None)
+
+    runner = SSHTaskRunner("config.toml", backend="controlmaster")
+    yield runner
+    runner.close()
+
+
+def _outcome(results) -> list:
+    return [(r.stdout, r.stderr, r.exit_status) for r in results]
+
+
+# --- Batched mode ---
+def test_batch_splits_output_per_step(runner):
+    results = runner._run_batch(
+        [
+            Command("echo a; echo b >&2"),
+            Command("printf c"),
+            Command("printf d >&2"),
+            Command("true"),
+        ]
+    )
+
+    assert _outcome(results) == [
+        ("a", "b", 0),
+        ("c", "", 0),
+        ("", "d", 0),
+        ("", "", 0),
+    ]
+
+
+def test_batch_stops_at_failing_step(runner, tmp_path):
+    flag = tmp_path / "ran"
+    results = runner._run_batch(
+        [
+            Command("echo one"),
+            Command("echo two; exit 3"),
+            Command(f"touch {flag}"),
+        ]
+    )
+
+    assert _outcome(results) == [("one", "", 0), ("two", "", 3)]
+    assert not flag.exists()
+
+
+def test_batch_step_without_marker_takes_script_status(runner):
+    results = runner._run_batch(
+        [
+            Command("echo a"),
+            Command("echo partial; kill -9 $$"),
+            Command("echo never"),
+        ]
+    )
+
+    assert _outcome(results) == [("a", "", 0), ("partial", "", -9)]
+
+
+def test_batch_missing_marker_after_clean_exit_fails(runner):
+    runner._exec = lambda script, pty=False: (b"", b"", 0)
+
+    results = runner._run_batch([Command("echo a"), Command("echo b")])
+
+    assert _outcome(results) == [("", "", -1)]
+
+
+def test_wrap_keeps_directory_changes_and_exit_in_the_step(runner):
+    script = runner._wrap("cd /; exit 5", "M") + runner._wrap("pwd", "N")
+
+    out, _, status = runner._exec(f"cd {os.getcwd()}\n{script}")
+
+    assert out.decode() == f"\nM5\n{os.getcwd()}\n\nN0\n"
+    assert status == 0
+
+
+# --- Shell mode ---
+def test_shell_is_opened_on_first_shell_step(runner):
+    runner._run_batch([Command("true")])
+    assert runner.chan is None
+
+    runner._run_shell_command(Command("true"))
+    assert runner.chan is not None
+
+
+def test_shell_skips_startup_output(runner):
+    result = runner._run_shell_command(Command("echo out; echo err >&2"))
+
+    assert _outcome([result]) == [("out", "err", 0)]
+
+
+def test_shell_runs_steps_in_order(runner):
+    results = [
+        runner._run_shell_command(Command("printf x")),
+        runner._run_shell_command(Command("cd /; exit 4")),
+        runner._run_shell_command(Command("pwd", directory="/tmp")),
+    ]
+
+    assert _outcome(results) == [("x", "", 0), ("", "", 4), ("/tmp", "", 0)]
+
+
+def test_shell_drains_both_streams(runner):
+    # More than a pipe buffer on each stream, stderr first.
+    result = runner._run_shell_command(
+        Command(
+            "head -c 200000 /dev/zero | tr '\\0' e >&2; "
+            "head -c 200000 /dev/zero | tr '\\0' o"
+        )
+    )
+
+    assert result.exit_status == 0
+    assert result.stdout == "o" * 200000
+    assert result.stderr == "e" * 200000
+
+
+def test_shell_closed_mid_step_fails(runner):
+    result = runner._run_shell_command(Command("kill -9 $$"))
+
+    assert result.exit_status == -1
+    assert "closed" in result.stderr
+
+
+def test_close_does_not_wait_for_a_timed_out_step(runner):
+    runner.config["ssh"]["timeout"] = 0.5
+
+    result = runner._run_shell_command(Command("sleep 10"))
+    started = time.monotonic()
+    runner.close()
+
+    assert result.exit_status == -1
+    assert "Timed out" in result.stderr
+    assert time.monotonic() - started < runner.SHELL_EXIT_TIMEOUT + 2
+
+
+# --- Command ---
+def test_command_build_runs_in_directory_and_is_cached(runner):
+    command = Command("pwd", directory="/")
+
+    built = command.build()
+
+    assert command.build() is built
+    assert _outcome([runner._run_command(command)]) == [("/", "", 0)]
+
+
+@pytest.mark.parametrize(
+    "capture_stdout, capture_stderr, expected",
+    [
+        (True, True, ("out", "err", 2)),
+        (False, True, ("", "err", 2)),
+        (True, False, ("out", "", 2)),
+        (False, False, ("", "", 2)),
+    ],
+)
+def test_command_discards_uncaptured_streams(
+    runner, capture_stdout, capture_stderr, expected
+):
+    command = Command(
+        "echo out; echo err >&2; exit 2",
+        directory="/",
+        capture_stdout=capture_stdout,
+        capture_stderr=capture_stderr,
+    )
+
+    assert _outcome([runner._run_command(command)]) == [expected]
+
+
+# --- Config caching ---
+@pytest.fixture
+def config_env(tmp_path, monkeypatch):
+    """A config file, with the config caches emptied and kept under tmp_path."""
+
+    cache_root = tmp_path / "tmp"
+    cache_root.mkdir()
+    monkeypatch.setattr(ssh_task_runner.tempfile, "tempdir", str(cache_root))
+    monkeypatch.setattr(ssh_task_runner, "_CONFIG_CACHE", {})
+
+    path = tmp_path / "config.toml"
+    path.write_text('[ssh]\nhost = "a"\n')
+    return path
+
+
+def test_config_is_cached_in_process(config_env, monkeypatch):
+    loader = _RunnerBase()
+    config = loader._load_config(config_env)
+    config["ssh"]["host"] = "changed"
+
+    def fail(*args):
+        raise AssertionError("config was reparsed")
+
+    monkeypatch.setattr(ssh_task_runner, "_parse_config", fail)
+
+    assert loader._load_config(config_env) == {"ssh": {"host": "a"}}
+
+
+def test_config_is_reloaded_when_the_file_changes(config_env):
+    loader = _RunnerBase()
+    loader._load_config(config_env)
+
+    config_env.write_text('[ssh]\nhost = "bb"\n')
+
+    assert loader._load_config(config_env) == {"ssh": {"host": "bb"}}
+
+
+def _cache_files() -> list:
+    return sorted(os.listdir(ssh_task_runner._config_cache_dir()))
+
+
+def test_config_pickle_is_used_by_a_new_process(config_env, monkeypatch):
+    _RunnerBase()._load_config(config_env)
+    ssh_task_runner._CONFIG_CACHE.clear()
+
+    # Parsing would now fail to import a TOML parser.
+    monkeypatch.setitem(sys.modules, "tomllib", None)
+    monkeypatch.setitem(sys.modules, "tomli", None)
+
+    assert _RunnerBase()._load_config(config_env) == {"ssh": {"host": "a"}}
+
+
+def test_config_keeps_one_pickle_per_path(config_env):
+    loader = _RunnerBase()
+    for host in ("b", "cc", "ddd"):
+        config_env.write_text(f'[ssh]\nhost = "{host}"\n')
+        assert loader._load_config(config_env) == {"ssh": {"host": host}}
+
+    assert len(_cache_files()) == 1
+
+
+def test_unreadable_config_pickle_is_replaced(config_env):
+    _RunnerBase()._load_config(config_env)
+    ssh_task_runner._CONFIG_CACHE.clear()
+    (pickle_name,) = _cache_files()
+    cache_dir = ssh_task_runner._config_cache_dir()
+    (cache_dir / pickle_name).write_bytes(b"not a pickle")
+
+    assert _RunnerBase()._load_config(config_env) == {"ssh": {"host": "a"}}
+    assert _cache_files() == [pickle_name]
+
+
+def test_failed_config_pickle_write_leaves_no_files(config_env, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(ssh_task_runner.os, "replace", fail)
+
+    assert _RunnerBase()._load_config(config_env) == {"ssh": {"host": "a"}}
+    assert _cache_files() == []
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="POSIX permissions")
+def test_shared_config_cache_dir_is_not_used(config_env):
+    cache_dir = ssh_task_runner._config_cache_dir()
+    cache_dir.chmod(0o777)
+
+    assert ssh_task_runner._config_cache_dir() is None
+    assert _RunnerBase()._load_config(config_env) == {"ssh": {"host": "a"}}
+    assert os.listdir(cache_dir) == []
+
+
+# --- Connection pool ---
+class StubClient:
+    """Stands in for a paramiko.SSHClient and its transport."""
+
+    def __init__(self):
+        self.active = True
+        self.closed = False
+
+    def get_transport(self):
+        return self
+
+    def is_active(self) -> bool:
+        return self.active and not self.closed
+
+    def set_keepalive(self, interval: int) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def pooled_runner(monkeypatch):
+    """Returns a factory of paramiko runners whose connections are StubClients."""
+
+    monkeypatch.setattr(ssh_task_runner, "_POOL", {})
+    monkeypatch.setattr(ssh_task_runner, "_BORROWED", {})
+    monkeypatch.setattr(SSHTaskRunner, "_connect", lambda self: StubClient())
+
+    def make(**settings) -> SSHTaskRunner:
+        config = {"ssh": {"host": "h", "user": "u", "password": "p", **settings}}
+        monkeypatch.setattr(SSHTaskRunner, "_load_config", lambda self, path: config)
+        return SSHTaskRunner("config.toml")
+
+    return make
+
+
+def test_pool_reuses_returned_connection(pooled_runner):
+    first = pooled_runner()
+    client = first.main_ssh
+    first.close()
+
+    assert pooled_runner().main_ssh is client
+
+
+def test_pool_keeps_connections_apart_by_settings(pooled_runner):
+    lax = pooled_runner(auto_add_host_key=True)
+    client = lax.main_ssh
+    lax.close()
+
+    assert pooled_runner().main_ssh is not client
+    assert pooled_runner(auto_add_host_key=True, compress=False).main_ssh is not client
+    assert pooled_runner(auto_add_host_key=True).main_ssh is client
+
+
+def test_pool_clear_closes_idle_connections(pooled_runner):
+    runner = pooled_runner()
+    client = runner.main_ssh
+    runner.close()
+
+    ssh_task_runner.SSHPool.clear()
+
+    assert client.closed
+    assert pooled_runner().main_ssh is not client
+
+
+def test_close_twice_leaves_the_next_borrower_alone(pooled_runner):
+    first = pooled_runner()
+    client = first.main_ssh
+    first.close()
+    second = pooled_runner()
+
+    first.close()
+
+    assert second.main_ssh is client
+    assert pooled_runner().main_ssh is not client
+    assert not client.closed
+
+
+def test_put_ignores_connections_it_did_not_lend():
+    client = StubClient()
+
+    ssh_task_runner.SSHPool.put(client)
+
+    assert not client.closed
+    assert client not in ssh_task_runner._BORROWED
+
+
+def test_dead_connection_is_closed_not_pooled(pooled_runner):
+    runner = pooled_runner()
+    client = runner.main_ssh
+    client.active = False
+    runner.close()
+
+    assert client.closed
+    assert pooled_runner().main_ssh is not client
+
+
+# --- Paramiko backend ---
+@pytest.fixture
+def ssh_server():
+    """
+    An in-process paramiko SSH server on localhost that accepts any password.
+
+    Exec requests are handed to `on_exec(channel, command)` on a new thread.
+    """
+
+    paramiko = pytest.importorskip("paramiko")
+    server = types.SimpleNamespace(
+        host_keys=[paramiko.ECDSAKey.generate(), paramiko.RSAKey.generate(2048)],
+        on_exec=None,
+    )
+
+    class Interface(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+        def check_channel_exec_request(self, channel, command):
+            threading.Thread(
+                target=server.on_exec, args=(channel, command.decode()), daemon=True
+            ).start()
+            return True
+
+    listener = socket.create_server(("127.0.0.1", 0))
+    server.port = listener.getsockname()[1]
+    transports = []
+
+    def serve():
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            transports.append(transport)
+            for key in server.host_keys:
+                transport.add_server_key(key)
+            try:
+                transport.start_server(server=Interface())
+            except Exception:
+                transport.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server
+    listener.close()
+    for transport in transports:
+        transport.close()
+
+
+@pytest.fixture
+def remote_runner(ssh_server, tmp_path, monkeypatch):
+    """
+    Returns a factory of paramiko runners connected to `ssh_server`.
+
+    ~/.ssh/known_hosts lives under tmp_path and starts out missing.
+    """
+
+    monkeypatch.setattr(ssh_task_runner, "_POOL", {})
+    monkeypatch.setattr(ssh_task_runner, "_BORROWED", {})
+    monkeypatch.setenv("HOME", str(tmp_path))
+    ssh_task_runner._known_hosts.cache_clear()
+    runners = []
+
+    def make(**settings) -> SSHTaskRunner:
+        config = {
+            "ssh": {
+                "host": "127.0.0.1",
+                "port": ssh_server.port,
+                "user": "user",
+                "password": "password",
+                **settings,
+            }
+        }
+        monkeypatch.setattr(SSHTaskRunner, "_load_config", lambda self, path: config)
+        runner = SSHTaskRunner("config.toml")
+        runners.append(runner)
+        return runner
+
+    yield make
+    for runner in runners:
+        runner.close()
+    ssh_task_runner.SSHPool.clear()
+    ssh_task_runner._known_hosts.cache_clear()
+
+
+def _write_known_hosts(home, server, key) -> None:
+    (home / ".ssh").mkdir(exist_ok=True)
+    (home / ".ssh" / "known_hosts").write_text(
+        f"[127.0.0.1]:{server.port} {key.get_name()} {key.get_base64()}\n"
+    )
+
+
+def test_unknown_host_is_rejected(remote_runner):
+    with pytest.raises(Exception, match="not found in known_hosts"):
+        remote_runner()
+
+
+def test_unknown_host_is_accepted_with_auto_add(remote_runner):
+    runner = remote_runner(auto_add_host_key=True)
+
+    assert runner.main_ssh.get_transport().is_active()
+
+
+def test_known_host_key_type_is_negotiated(remote_runner, ssh_server, tmp_path):
+    # Only the RSA key is known, though ECDSA would be preferred by default.
+    _write_known_hosts(tmp_path, ssh_server, ssh_server.host_keys[1])
+
+    runner = remote_runner()
+
+    server_key = runner.main_ssh.get_transport().get_remote_server_key()
+    assert server_key.get_name() == "ssh-rsa"
+
+
+def test_mismatched_host_key_is_rejected(remote_runner, ssh_server, tmp_path):
+    paramiko = pytest.importorskip("paramiko")
+    _write_known_hosts(tmp_path, ssh_server, paramiko.RSAKey.generate(2048))
+
+    with pytest.raises(paramiko.BadHostKeyException):
+        remote_runner()
+
+
+def test_exec_keeps_output_sent_after_the_exit_status(remote_runner, ssh_server):
+    def on_exec(channel, command):
+        channel.sendall(b"before\n")
+        channel.send_exit_status(3)
+        time.sleep(0.2)
+        channel.sendall(b"after\n")
+        channel.sendall_stderr(b"late\n")
+        channel.shutdown_write()
+        channel.close()
+
+    ssh_server.on_exec = on_exec
+    runner = remote_runner(auto_add_host_key=True)
+
+    result = runner._run_command(Command("anything"))
+
+    assert _outcome([result]) == [("before\nafter", "late", 3)]
+
+
+# --- Streaming ---
+def test_output_is_streamed_while_the_command_runs(runner, tmp_path):
+    # The command only finishes once the callback has seen its first line.
+    flag = tmp_path / "seen"
+    out, err = [], []
+
+    def on_stdout(chunk: bytes) -> None:
+        out.append(chunk)
+        flag.touch()
+
+    result = runner._run_command_streaming(
+        Command(
+            "echo first; echo warn >&2; "
+            f"for i in $(seq 100); do [ -e {flag} ] && break; sleep 0.05; done; "
+            f"[ -e {flag} ] && echo second"
+        ),
+        on_stdout,
+        err.append,
+    )
+
+    assert result.exit_status == 0
+    assert (result.stdout, result.stderr) == ("", "")
+    assert b"".join(out) == b"first\nsecond\n"
+    assert b"".join(err) == b"warn\n"
+
+
+def test_streaming_requires_exec_mode(runner):
+    with pytest.raises(ValueError):
+        runner.execute([Command("true")], mode="shell", on_stdout=print)